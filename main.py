@@ -1,16 +1,57 @@
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import sqlite3
 import os
+import abc
 from dotenv import load_dotenv
+try:
+    import orjson  # Optional: faster JSON parsing/serialization
+except ImportError:
+    orjson = None
+try:
+    import fastjsonschema  # Optional: compiled question validation
+except ImportError:
+    fastjsonschema = None
 import threading
-# import time # Unused import
+import queue
+import math
+import time
+import hashlib
+import re
+import string
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# Load .env before the module-level settings below read the environment
+load_dotenv()
 
 # --- Configuration ---
 DB_NAME = 'english_quiz.db'
+# Target number of questions per generation
 QUESTIONS_PER_GENERATION = 10
+# Number of smaller API calls issued concurrently per generation. Each call
+# asks for ceil(QUESTIONS_PER_GENERATION / PARALLELISM) questions, so wall
+# time is bounded by the slowest (short) call instead of one long one.
+# Capped so that every call asks for at least one question.
+PARALLELISM = min(QUESTIONS_PER_GENERATION,
+                  max(1, int(os.getenv("GEN_PARALLELISM", "4"))))
+# Per-provider request budget shared by all shards; 0 disables the limit
+MAX_REQUESTS_PER_MINUTE = int(os.getenv("MAX_REQUESTS_PER_MINUTE", "20"))
+# Retries for connection errors and 429/5xx responses, with exponential
+# backoff (at most 8s with 4 retries); Retry-After headers are honoured
+API_MAX_RETRIES = 4
+# Bank fallback picks random questions among this many most recent ones
+QUESTION_BANK_WINDOW = 500
+# Identical generation requests are served from the local DB for this long
+RESPONSE_CACHE_TTL_DAYS = 7
+# If true and both API keys are set, query both providers at once and use
+# whichever starts returning questions first
+API_FANOUT = os.getenv("API_FANOUT", "false").lower() in ("1", "true", "yes")
 # Consider adding a model choice here if needed, e.g., "openai/gpt-3.5-turbo"
 # Get model from environment variable or use a default
 OPENROUTER_MODEL = os.getenv(
@@ -19,10 +60,100 @@ OPENROUTER_MODEL = os.getenv(
 )  # Example model
 
 
+# --- Question Schema ---
+# JSON Schema of one generated question object. It is also sent to the APIs
+# as the structured-output schema, so the descriptions double as the
+# instructions for each field.
+QUESTION_SCHEMA = {
+    "type": "object",
+    "required": ["question", "options", "answer", "explanation",
+                 "translation"],
+    "properties": {
+        "question": {
+            "type": "string",
+            "description": "問題文。文章補完問題の場合は空欄を \"___\" で示す。"},
+        "options": {
+            "type": "array", "items": {"type": "string"},
+            "minItems": 4, "maxItems": 4,
+            "description": "4つの選択肢。"},
+        "answer": {
+            "type": "integer", "minimum": 1, "maximum": 4,
+            "description": "正解の選択肢の番号 (1から4)。"},
+        "explanation": {
+            "type": "string",
+            "description": "正解がなぜ正しく、他の選択肢がなぜ不適切かを簡潔に"
+                           "説明する日本語の解説。"},
+        "translation": {
+            "type": "string",
+            "description": "問題文の日本語訳。文章補完問題の場合は補完後の文の訳。"},
+    },
+}
+# JSON Schema of a whole API response
+QUESTIONS_SCHEMA = {"type": "array", "items": QUESTION_SCHEMA}
+
+# --- JSON Helpers ---
+# orjson's decode error subclasses json.JSONDecodeError, so callers can keep
+# catching the stdlib exception either way.
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj):
+        """Serializes obj to UTF-8 encoded JSON bytes."""
+        return orjson.dumps(obj)
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj):
+        """Serializes obj to UTF-8 encoded JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
 # --- Database Setup ---
+# Applied to every connection: WAL journal with NORMAL sync (one fsync per
+# checkpoint instead of two per commit), 256 MB mmap, ~20 MB page cache.
+SQLITE_PRAGMAS = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA cache_size = -20000;
+    PRAGMA temp_store = MEMORY;
+"""
+
+
+# Statements run repeatedly; kept as constants so each call passes the same
+# string and hits sqlite3's per-connection statement cache.
+_SQL_INSERT = (
+    "INSERT OR IGNORE INTO problems (question, option1, option2, option3, "
+    "option4, answer, explanation, translation) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+# Samples from the newest QUESTION_BANK_WINDOW rows (via
+# idx_problems_genat) instead of sorting the whole bank randomly
+_SQL_SELECT_RANDOM = (
+    "SELECT * FROM ("
+    "SELECT id, question, option1, option2, option3, option4, answer, "
+    "explanation, translation FROM problems "
+    "ORDER BY generated_at DESC LIMIT ?"
+    ") ORDER BY RANDOM() LIMIT ?"
+)
+_SQL_CACHE_GET = (
+    "SELECT payload FROM response_cache "
+    "WHERE key = ? AND ts >= datetime('now', ?)"
+)
+_SQL_CACHE_PUT = (
+    "INSERT OR REPLACE INTO response_cache (key, payload) VALUES (?, ?)"
+)
+
+
+def _configure_connection(conn):
+    """Applies SQLITE_PRAGMAS to a freshly opened connection."""
+    conn.executescript(SQLITE_PRAGMAS)
+
+
 def initialize_database():
     """Creates the database and table if they don't exist."""
     conn = sqlite3.connect(DB_NAME)
+    _configure_connection(conn)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS problems (
@@ -38,271 +169,613 @@ def initialize_database():
             generated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         );
     """)
+    # Questions accumulate into a bank; duplicates are skipped on insert.
+    # Done as an index so databases created before this also get it.
+    cursor.execute("SELECT 1 FROM sqlite_master "
+                   "WHERE type = 'index' AND name = 'idx_problems_question'")
+    if cursor.fetchone() is None:
+        # Older databases may hold duplicates, which would block the index
+        cursor.execute("""
+            DELETE FROM problems WHERE id NOT IN (
+                SELECT MIN(id) FROM problems GROUP BY question
+            );
+        """)
+        cursor.execute(
+            "CREATE UNIQUE INDEX idx_problems_question ON problems (question);")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_problems_genat "
+        "ON problems (generated_at DESC);"
+    )
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            payload BLOB NOT NULL,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
     conn.commit()
     conn.close()
 
 
+def _fetch_random_questions(conn, limit):
+    """Returns up to limit random questions from the question bank.
+
+    conn must have row_factory set to sqlite3.Row.
+    """
+    cursor = conn.execute(_SQL_SELECT_RANDOM, (QUESTION_BANK_WINDOW, limit))
+    return [{
+        "id": row["id"],
+        "question": row["question"],
+        "options": [row["option1"], row["option2"],
+                    row["option3"], row["option4"]],
+        "answer": row["answer"],
+        "explanation": row["explanation"],
+        "translation": row["translation"]
+    } for row in cursor]
+
+
+def _response_cache_key(provider, model, difficulty, assist_prompt):
+    """Returns the response_cache key for one set of generation parameters."""
+    raw = "|".join([provider, model, difficulty, assist_prompt,
+                    str(QUESTIONS_PER_GENERATION)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _pack_cache_payload(questions_data):
+    """Serializes question data into a zlib-compressed response_cache BLOB."""
+    return sqlite3.Binary(zlib.compress(_json_dumps(questions_data)))
+
+
+def _unpack_cache_payload(payload):
+    """Inverse of _pack_cache_payload.
+
+    Rows written before compression was introduced hold plain JSON text.
+    """
+    if isinstance(payload, str):
+        return _json_loads(payload)
+    return _json_loads(zlib.decompress(payload))
+
+
+# --- Prompts ---
+# Map difficulty selection to CEFR levels for the prompt
+DIFFICULTY_LEVELS = {
+    "Beginner (A2)": "CEFR A2レベル",
+    "Intermediate (B1)": "CEFR B1レベル",
+    "Advanced (B2)": "CEFR B2レベル",
+    "Upper-Intermediate (C1)": "CEFR C1レベル",
+    "Proficient (C2)": "CEFR C2レベル",
+}
+DEFAULT_LEVEL = "CEFR B1レベル"
+
+# The prompt is a constant prefix followed by a short per-request suffix.
+# Keeping the prefix byte-identical across calls lets providers reuse their
+# prompt (prefix) cache, so everything that varies goes into the suffix.
+# The output format is enforced through QUESTIONS_SCHEMA where the provider
+# supports it; the key list is kept in the prefix for those that don't
+# (OpenRouter silently drops response_format for such models).
+PROMPT_PREFIX = """英語学習者向けの多肢選択式の英文法および簡単な文章補完問題を生成してください。
+よく使われる文法項目（時制、句動詞、前置詞、冠詞、基本的な文構造など）に焦点を当ててください。
+JSONのみを出力し、互いに異なる問題オブジェクトを指定された数だけ配列に含めてください。
+各オブジェクトのキー: "question"（問題文。空所は "___"）、"options"（4つの選択肢の文字列の配列）、"answer"（正解の番号、1〜4の整数）、"explanation"（日本語の解説）、"translation"（問題文の日本語訳）
+問題数と対象レベルは最後に指定します。
+"""
+PROMPT_SUFFIX_TMPL = string.Template("""
+問題数: ${n_questions}個
+対象レベル: ${level}
+${focus}${assist}""")
+ASSIST_TMPL = string.Template("さらに、問題生成に関して以下の要望も考慮してください: ${assist_prompt}")
+# Parallel shards of one generation share the same prompt otherwise, so
+# each is steered to its own grammar area to keep their questions apart
+SHARD_FOCUSES = ("時制", "句動詞", "前置詞", "冠詞と名詞", "基本的な文構造",
+                 "助動詞", "関係詞", "比較表現", "不定詞と動名詞", "接続詞")
+FOCUS_TMPL = string.Template("今回は特に「${focus}」を中心に出題してください。\n")
+OPENROUTER_SYSTEM_PROMPT = ("You are an AI assistant that generates English "
+                            "multiple-choice questions in JSON format.")
+# OpenRouter only honours explicit cache breakpoints for these model families
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def _to_gemini_schema(schema):
+    """Converts a JSON Schema to Gemini's OpenAPI-style Schema object."""
+    converted = {}
+    for key, value in schema.items():
+        if key == "type":
+            value = value.upper()
+        elif key == "items":
+            value = _to_gemini_schema(value)
+        elif key == "properties":
+            value = {name: _to_gemini_schema(prop)
+                     for name, prop in value.items()}
+        converted[key] = value
+    return converted
+
+
+GEMINI_RESPONSE_SCHEMA = _to_gemini_schema(QUESTIONS_SCHEMA)
+
+
+def _render_prompt_suffix(difficulty, assist_prompt, n_questions,
+                          focus=None):
+    """Returns the per-request part of the prompt."""
+    return PROMPT_SUFFIX_TMPL.substitute(
+        n_questions=n_questions,
+        level=DIFFICULTY_LEVELS.get(difficulty, DEFAULT_LEVEL),
+        focus=FOCUS_TMPL.substitute(focus=focus) if focus else "",
+        assist=ASSIST_TMPL.substitute(assist_prompt=assist_prompt)
+        if assist_prompt else ""
+    )
+
+
 # --- API Interaction ---
-def _generate_via_openrouter(api_key, model, difficulty, assist_prompt):
-    """Generates questions using the OpenRouter API."""
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    # Map difficulty selection to CEFR levels for the prompt
-    difficulty_map = {
-        "Beginner (A2)": "CEFR A2レベル",
-        "Intermediate (B1)": "CEFR B1レベル",
-        "Advanced (B2)": "CEFR B2レベル",
-        "Upper-Intermediate (C1)": "CEFR C1レベル",
-        "Proficient (C2)": "CEFR C2レベル",
-    }
-    target_level = difficulty_map.get(
-        difficulty, "CEFR B1レベル")  # Default to B1
-
-    # Carefully crafted prompt based on requirements
-    prompt_text = f"""
-    英語学習者向けの多肢選択式の英文法および簡単な文章補完問題を{QUESTIONS_PER_GENERATION}個生成してください。
-    対象レベルは {target_level} です。
-    よく使われる文法項目（時制、句動詞、前置詞、冠詞、基本的な文構造など）に焦点を当ててください。
-
-    出力は厳密にJSONオブジェクトの配列形式で提供してください。各オブジェクトには以下のキーが必要です：
-    - "question": 問題文 (文字列)。文章補完問題の場合は "..." を使用してください。
-    - "options": 選択肢を表す4つの文字列の配列。
-    - "answer": 正解の選択肢のインデックス（1から始まる整数）。
-    - "explanation": 正解がなぜ正しいのか、そして他の選択肢がなぜ不適切なのかを簡潔に説明する**日本語の**解説文（文字列）。
-    - "translation": 問題文 ("question") の日本語訳 (文字列)。文章補間問題の場合は、文章補間の日本語訳も含めてください。
-
-    {f'さらに、問題生成に関して以下の要望も考慮してください: {assist_prompt}' if assist_prompt else ''}
-
-    1つの問題オブジェクトのフォーマット例:
-    {{
-      "question": "She ___ watching TV when I arrived.",
-      "translation": "私が到着した時、彼女はテレビを見ていました。",
-      "options": ["is", "was", "be", "are"],
-      "answer": 2,
-      "explanation": "過去進行形 'was watching' を使います。これは、過去のある時点（arrived）で進行中だった動作を表します。"
-    }}
-
-    Ensure you provide exactly {QUESTIONS_PER_GENERATION} distinct question
-    objects in the JSON array. Do not include any text before or after the
-    JSON array.
+def _create_http_session():
+    """Returns a keep-alive session shared by all API calls of the app."""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    retry = Retry(
+        total=API_MAX_RETRIES,
+        # A read timeout means the generation was already submitted (and
+        # billed); only connect errors and status_forcelist are retried
+        read=0,
+        # Only arguments urllib3 1.26 also accepts (requests allows both)
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,  # All API calls are POSTs
+        raise_on_status=False  # Let raise_for_status report the last error
+    )
+    # Room for every shard of two fanned-out providers at once
+    adapter = HTTPAdapter(pool_connections=4,
+                          pool_maxsize=max(8, 2 * PARALLELISM),
+                          max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class _JSONArrayStream:
+    """Incrementally parses the items of a JSON array as text arrives.
+
+    Text before the array (e.g. a ```json fence or a short preamble, even one
+    containing brackets) and after its closing ']' is ignored. Literal
+    newlines inside strings are accepted.
     """
+    _decoder = json.JSONDecoder(strict=False)
+    # A '[' that opens an array of objects (or an empty array)
+    _ARRAY_START = re.compile(r"\[(?=\s*[{\]])")
+    _SEPARATORS = re.compile(r"[\s,]*")
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None  # Parse position in _buffer once the array started
+        self._finished = False
+
+    def feed(self, text):
+        """Adds text and returns the list of items completed by it."""
+        items = []
+        if self._finished:
+            return items
+        self._buffer += text
+        if self._pos is None:
+            match = self._ARRAY_START.search(self._buffer)
+            if not match:
+                return items
+            self._pos = match.end()
+        buffer = self._buffer
+        while True:
+            pos = self._SEPARATORS.match(buffer, self._pos).end()
+            self._pos = pos
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                self._finished = True
+                break
+            try:
+                item, self._pos = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Item not complete yet; wait for more text
+            items.append(item)
+        # Keep only the unfinished item, trimming once per feed
+        self._buffer = buffer[self._pos:]
+        self._pos = 0
+        return items
 
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "You are an AI assistant that "
-             "generates English multiple-choice "
-             "questions in JSON format."},
-            {"role": "user", "content": prompt_text}
-        ]
-        # Add other parameters if needed (temperature, max_tokens etc.)
-        # "max_tokens": 2048, # Example limit
-    }
+    def close(self):
+        """Raises if the stream ended before the array was complete."""
+        if self._pos is None:
+            raise ValueError("Response did not contain a JSON array.")
+        if not self._finished:
+            if self._buffer:
+                # Re-parse the leftover to surface the real decode error
+                self._decoder.decode(self._buffer)
+            raise ValueError("Response ended before the JSON array closed.")
 
-    try:
-        # Use a reasonable timeout (90 seconds)
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=90
-        )
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx/5xx)
 
-        response_json = response.json()
+def _iter_sse_data(response):
+    """Yields the payload of each 'data:' line of a server-sent event stream."""
+    for line in response.iter_lines():
+        if line.startswith(b"data:"):
+            yield line[5:].strip().decode("utf-8")
 
-        # Extract the content which should be the JSON string
-        content_string = response_json.get(
-            "choices", [{}]
-        )[0].get("message", {}).get("content", "")
 
-        if not content_string:
-            raise ValueError(
-                "OpenRouter API response did not contain text content.")
-
-        # Replace literal newlines within the string content that might break JSON parsing
-        # Also remove potential markdown code block formatting
-        if content_string.startswith("```json"):
-            content_string = content_string.strip("```json\n ")
-        if content_string.endswith("```"):
-            content_string = content_string.strip("\n ```")
-        content_string = content_string.replace('\n', ' ')
-        questions_data = json.loads(content_string)
-
-        # --- Validation (common for both API responses) ---
-        if not isinstance(questions_data, list):
-            raise ValueError("Generated data is not a list.")
-        if len(questions_data) != QUESTIONS_PER_GENERATION:
-            print(f"Warning: API generated {len(questions_data)} questions "
-                  f"instead of {QUESTIONS_PER_GENERATION}. Using what was "
-                  "generated.")
-            # Allow partial generation for robustness
-        for q in questions_data:
-            if not all(k in q for k in ["question", "options", "answer",
-                                        "explanation", "translation"]):
-                raise ValueError(
-                    "Generated question object missing required keys.")
-            if not isinstance(q["options"], list) or len(q["options"]) != 4:
-                raise ValueError(
-                    "Generated 'options' is not a list of 4 elements.")
-            if not isinstance(q["answer"], int) or not (1 <= q["answer"] <= 4):
-                raise ValueError(
-                    "Generated 'answer' must be an integer between 1 and 4."
-                )
-        return questions_data
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to OpenRouter API: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response from OpenRouter API: {e}")
-        # Log the problematic content
-        print("Received content:",
-              content_string if 'content_string' in locals() else response.text)
-        return None
-    except ValueError as e:
-        print(f"Error validating generated data: {e}")
-        return None
-    except Exception as e:  # Catch unexpected errors
-        print(f"An unexpected error occurred during OpenRouter API call: {e}")
-        return None
+class _GenerationCancelled(Exception):
+    """Raised from on_question to abort a provider that lost a race."""
 
 
-def _generate_via_gemini(api_key, model, difficulty, assist_prompt):
-    """Generates questions using the Google Gemini API."""
-    # Define the Gemini API endpoint (adjust model name if needed)
-    # Make sure the model passed in `model` is compatible with this endpoint
-    gemini_endpoint = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
-
-    difficulty_map = {
-        "Beginner (A2)": "CEFR A2レベル",
-        "Intermediate (B1)": "CEFR B1レベル",
-        "Advanced (B2)": "CEFR B2レベル",
-        "Upper-Intermediate (C1)": "CEFR C1レベル",
-        "Proficient (C2)": "CEFR C2レベル",
-    }
-    target_level = difficulty_map.get(difficulty, "CEFR B1レベル")
-
-    # Construct the prompt specifically for Gemini
-    # Ensure it strongly requests JSON output only
-    prompt_text = f"""
-    英語学習者向けの多肢選択式の英文法および簡単な文章補完問題を{QUESTIONS_PER_GENERATION}個生成してください。
-    対象レベルは {target_level} です。
-    よく使われる文法項目（時制、句動詞、前置詞、冠詞、基本的な文構造など）に焦点を当ててください。
-
-    出力は厳密にJSONオブジェクトの配列形式で提供してください。各オブジェクトには以下のキーが必要です：
-    - "question": 問題文 (文字列)。文章補完問題の場合は "..." を使用してください。
-    - "options": 選択肢を表す4つの文字列の配列。
-    - "answer": 正解の選択肢のインデックス（1から始まる整数）。
-    - "explanation": 正解がなぜ正しいのか、そして他の選択肢がなぜ不適切なのかを簡潔に説明する**日本語の**解説文（文字列）。
-    - "translation": 問題文 ("question") の日本語訳 (文字列)。
-
-    {f'さらに、問題生成に関して以下の要望も考慮してください: {assist_prompt}' if assist_prompt else ''}
-
-    1つの問題オブジェクトのフォーマット例:
-    {{
-      "question": "She ___ watching TV when I arrived.",
-      "translation": "私が到着した時、彼女はテレビを見ていました。",
-      "options": ["is", "was", "be", "are"],
-      "answer": 2,
-      "explanation": "過去進行形 'was watching' を使います。なぜなら、別の過去の動作（到着した）が発生したときに、その動作が進行中だったからです。"
-    }}
-
-    Ensure you provide exactly {QUESTIONS_PER_GENERATION} distinct question
-    objects in the JSON array. **JSON配列のみを出力してください。導入テキスト、
-    コードブロック形式（例: ```json）、終了テキストは含めないでください。**
+class _Cancellation:
+    """A cancel flag that is also set whenever its parent is.
+
+    Quacks like the threading.Event passed as cancel to Provider.generate.
     """
 
-    data = {
-        "contents": [{
-            "role": "user",
-            "parts": [{
-                "text": prompt_text
-            }]
-        }],
-        "generationConfig": {
-            "responseMimeType": "application/json",  # Request JSON output
-        }
-    }
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._parent = parent
 
-    try:
-        # Add the API key as a query parameter
-        response = requests.post(
-            f"{gemini_endpoint}?key={api_key}",
-            headers={"Content-Type": "application/json"},
-            json=data,
-            timeout=90
-        )
-        response.raise_for_status()
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or (
+            self._parent is not None and self._parent.is_set())
 
-        response_json = response.json()
 
-        # Extract the generated text containing the JSON array
-        if not response_json.get('candidates'):
+def _submit_daemon(fn, *args):
+    """Runs fn(*args) on a new daemon thread and returns a Future for it.
+
+    Unlike ThreadPoolExecutor workers, daemon threads do not hold up
+    interpreter exit while an API request is still in flight.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+if fastjsonschema is not None:
+    # Compiled once; raises JsonSchemaException, a ValueError subclass
+    _validate_question = fastjsonschema.compile(QUESTION_SCHEMA)
+else:
+    def _validate_question(q):
+        """Raises ValueError if q does not match QUESTION_SCHEMA."""
+        if not isinstance(q, dict) or not all(
+                k in q for k in QUESTION_SCHEMA["required"]):
             raise ValueError(
-                "Gemini API response missing 'candidates'. Response: " + response.text)
-        content = response_json['candidates'][0].get('content')
-        if not content or not content.get('parts'):
+                "Generated question object missing required keys.")
+        if not all(isinstance(q[k], str)
+                   for k in ("question", "explanation", "translation")):
+            raise ValueError("Generated question text fields must be strings.")
+        options = q["options"]
+        if (not isinstance(options, list) or len(options) != 4
+                or not all(isinstance(o, str) for o in options)):
             raise ValueError(
-                "Gemini API response missing 'content' or 'parts'. Response: " + response.text)
-        content_string = content['parts'][0].get('text', '')
-
-        if not content_string:
+                "Generated 'options' is not a list of 4 strings.")
+        answer = q["answer"]
+        if (not isinstance(answer, int) or isinstance(answer, bool)
+                or not (1 <= answer <= 4)):
             raise ValueError(
-                "Gemini API response did not contain text content.")
-
-        # Gemini might still wrap the JSON in ```json ... ```, attempt to remove it
-        if content_string.startswith("```json"):
-            content_string = content_string.strip("```json\n ")
-        if content_string.endswith("```"):
-            content_string = content_string.strip("\n ```")
-
-        # Replace literal newlines that might break JSON parsing
-        content_string = content_string.replace('\n', ' ')
-
-        questions_data = json.loads(content_string)
-
-        # --- Validation (common for both API responses) ---
-        if not isinstance(questions_data, list):
-            raise ValueError("Generated data is not a list.")
-        if len(questions_data) != QUESTIONS_PER_GENERATION:
-            print(f"Warning: API generated {len(questions_data)} questions "
-                  f"instead of {QUESTIONS_PER_GENERATION}. Using what was "
-                  "generated.")
-            # Allow partial generation for robustness
-        for q in questions_data:
-            if not all(k in q for k in ["question", "options", "answer",
-                                        "explanation", "translation"]):
-                raise ValueError(
-                    "Generated question object missing required keys.")
-            if not isinstance(q["options"], list) or len(q["options"]) != 4:
-                raise ValueError(
-                    "Generated 'options' is not a list of 4 elements.")
-            if not isinstance(q["answer"], int) or not (1 <= q["answer"] <= 4):
-                raise ValueError(
-                    "Generated 'answer' must be an integer between 1 and 4."
-                )
-        return questions_data
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Gemini API: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response from Gemini API: {e}")
-        print("Received content string attempt:",
-              content_string if 'content_string' in locals() else "Error before extraction")
-        print("Raw response:", response.text)
-        return None
+                "Generated 'answer' must be an integer between 1 and 4.")
+
+
+def _collect_question(q, questions_data, on_question):
+    """Validates one streamed question and hands it on if it is usable."""
+    try:
+        _validate_question(q)
     except ValueError as e:
-        print(
-            f"Error validating generated data or Gemini response structure: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred during Gemini API call: {e}")
-        return None
+        print(f"Skipping invalid generated question: {e}\nData: {q}")
+        return
+    if on_question:
+        # May raise _GenerationCancelled, or return False to reject the
+        # question (e.g. a duplicate); either way it is not kept
+        if on_question(q) is False:
+            return
+    questions_data.append(q)
+
+
+class _RateLimiter:
+    """Thread-safe token bucket allowing a number of requests per minute."""
+
+    def __init__(self, requests_per_minute):
+        self._rate = requests_per_minute / 60  # Tokens per second
+        self._capacity = max(1, requests_per_minute)
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        if self._rate <= 0:
+            return  # Unlimited
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self._rate
+            time.sleep(delay)
+
+
+class Provider(abc.ABC):
+    """An LLM API that generates questions.
+
+    Subclasses only describe the request (build_request) and where the
+    generated text sits in each streamed event (extract_text); generate()
+    owns the networking, stream parsing, validation and error handling.
+    """
+    name = "API"
+
+    def __init__(self, api_key, model):
+        self.api_key = api_key
+        self.model = model
+        # One request budget per provider, shared by all generations
+        self.rate_limiter = _RateLimiter(MAX_REQUESTS_PER_MINUTE)
+
+    @abc.abstractmethod
+    def build_request(self, prompt_suffix):
+        """Returns (url, headers, body) for a streamed generation request."""
+
+    @abc.abstractmethod
+    def extract_text(self, event):
+        """Returns the generated text carried by one decoded SSE event.
+
+        Returns None when the event marks the end of the stream.
+        """
+
+    def generate(self, session, difficulty, assist_prompt,
+                 n_questions=QUESTIONS_PER_GENERATION, on_question=None,
+                 cancel=None, focus=None):
+        """Generates questions, streaming them to on_question if given.
+
+        Returns the valid questions received (possibly fewer than
+        n_questions, since some may already be on screen when the stream
+        fails), or None if there were none. Once the cancel event is set,
+        the response is closed at the next streamed event. focus names a
+        grammar area to concentrate on.
+        """
+        if cancel is not None and cancel.is_set():
+            return None
+        url, headers, body = self.build_request(
+            _render_prompt_suffix(difficulty, assist_prompt, n_questions,
+                                  focus))
+        questions_data = []
+        try:
+            # Use a reasonable timeout (90 seconds)
+            response = session.post(url, headers=headers,
+                                    data=_json_dumps(body), timeout=90,
+                                    stream=True)
+            parser = _JSONArrayStream()
+            # Inside 'with' so that an error response is closed too and
+            # releases its connection back to the session's pool
+            with response:
+                response.raise_for_status()  # Raise HTTPError for bad responses (4xx/5xx)
+                for event in _iter_sse_data(response):
+                    if cancel is not None and cancel.is_set():
+                        raise _GenerationCancelled()
+                    text = self.extract_text(event)
+                    if text is None:
+                        break
+                    for q in parser.feed(text):
+                        _collect_question(q, questions_data, on_question)
+            parser.close()
+
+            if not questions_data:
+                raise ValueError(
+                    f"{self.name} API response did not contain any valid "
+                    "questions.")
+            if len(questions_data) != n_questions:
+                print(f"Warning: API generated {len(questions_data)} "
+                      f"questions instead of {n_questions}. Using what was "
+                      "generated.")
+                # Allow partial generation for robustness
+            return questions_data
+
+        except _GenerationCancelled:
+            return questions_data or None
+        except requests.exceptions.RequestException as e:
+            print(f"Error connecting to {self.name} API: {e}")
+            return questions_data or None
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON response from {self.name} API: {e}")
+            return questions_data or None
+        except ValueError as e:
+            print(f"Error validating generated data from {self.name} API: {e}")
+            return questions_data or None
+        except Exception as e:  # Catch unexpected errors
+            print(f"An unexpected error occurred during {self.name} API "
+                  f"call: {e}")
+            return questions_data or None
+
+
+class OpenRouterProvider(Provider):
+    """Generates questions using the OpenRouter API."""
+    name = "OpenRouter"
+
+    def build_request(self, prompt_suffix):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        if self.model.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+            # Mark the end of the constant prefix as a cache breakpoint
+            user_content = [
+                {"type": "text", "text": PROMPT_PREFIX,
+                 "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt_suffix}
+            ]
+        else:
+            user_content = PROMPT_PREFIX + prompt_suffix
+
+        body = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": OPENROUTER_SYSTEM_PROMPT},
+                {"role": "user", "content": user_content}
+            ],
+            # Structured outputs require an object at the top level; the
+            # stream parser picks up the array inside it all the same.
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "questions",
+                    "schema": {
+                        "type": "object",
+                        "required": ["questions"],
+                        "properties": {"questions": QUESTIONS_SCHEMA},
+                    },
+                },
+            },
+            "stream": True
+            # Add other parameters if needed (temperature, max_tokens etc.)
+            # "max_tokens": 2048, # Example limit
+        }
+        return ("https://openrouter.ai/api/v1/chat/completions", headers,
+                body)
+
+    def extract_text(self, event):
+        if event == "[DONE]":
+            return None
+        # Each event carries the next piece of the JSON string
+        return _json_loads(event).get(
+            "choices", [{}]
+        )[0].get("delta", {}).get("content") or ""
+
+
+class GeminiProvider(Provider):
+    """Generates questions using the Google Gemini API."""
+    name = "Gemini"
+
+    def build_request(self, prompt_suffix):
+        # Make sure the model is compatible with this endpoint. The API key
+        # is a query parameter; alt=sse selects SSE framing.
+        url = ("https://generativelanguage.googleapis.com/v1beta/models/"
+               f"{self.model}:streamGenerateContent?alt=sse&key={self.api_key}")
+        body = {
+            "contents": [{
+                "role": "user",
+                "parts": [{
+                    "text": PROMPT_PREFIX + prompt_suffix
+                }]
+            }],
+            "generationConfig": {
+                "responseMimeType": "application/json",  # Request JSON output
+                "responseSchema": GEMINI_RESPONSE_SCHEMA,
+            }
+        }
+        return url, {}, body
+
+    def extract_text(self, event):
+        # Each event carries the next piece of the generated text.
+        # The final event may only hold usage metadata.
+        candidates = _json_loads(event).get('candidates') or [{}]
+        parts = candidates[0].get('content', {}).get('parts') or [{}]
+        return parts[0].get('text', '')
+
+
+def _generate_sharded(provider, session, difficulty, assist_prompt,
+                      on_question=None, cancel=None):
+    """Splits one generation into PARALLELISM concurrent API calls.
+
+    Shards that fail are skipped; returns None only if every shard failed.
+    At most QUESTIONS_PER_GENERATION questions are kept; shards are stopped
+    once that many have arrived, or when cancel is set. Each shard gets its
+    own grammar focus, and questions repeated across shards are dropped.
+    on_question is called from the shard threads, so it must be thread-safe.
+    """
+    shard_size = math.ceil(QUESTIONS_PER_GENERATION / PARALLELISM)
+    lock = threading.Lock()
+    collected = [0]
+    seen = set()  # Question texts already collected
+
+    def collect(q):
+        with lock:
+            if collected[0] >= QUESTIONS_PER_GENERATION:
+                raise _GenerationCancelled()
+            if q["question"] in seen:
+                return False  # Not counted; the shard keeps streaming
+            seen.add(q["question"])
+            collected[0] += 1
+        if on_question:
+            on_question(q)
+        return True
+
+    def run_shard(focus):
+        provider.rate_limiter.acquire()
+        return provider.generate(session, difficulty, assist_prompt,
+                                 shard_size, collect, cancel, focus)
+
+    # A single call covers every grammar area on its own
+    focuses = ([SHARD_FOCUSES[i % len(SHARD_FOCUSES)]
+                for i in range(PARALLELISM)]
+               if PARALLELISM > 1 else [None])
+    futures = [_submit_daemon(run_shard, focus) for focus in focuses]
+    results = [future.result() for future in futures]
+
+    questions_data = [q for shard in results if shard for q in shard]
+    return questions_data[:QUESTIONS_PER_GENERATION] or None
+
+
+def _generate_raced(providers, session, difficulty, assist_prompt,
+                    on_question=None, cancel=None):
+    """Runs several providers concurrently and keeps the fastest one.
+
+    The first provider to produce a question wins; the others are
+    cancelled at once, closing their responses at the next streamed event
+    (or not sending at all), and their output is dropped. Returns the
+    winner's questions, or None if every provider failed.
+    """
+    if len(providers) == 1:
+        return _generate_sharded(providers[0], session, difficulty,
+                                 assist_prompt, on_question, cancel)
+
+    lock = threading.Lock()
+    winner = []
+    cancels = [_Cancellation(cancel) for _ in providers]
+
+    def make_callback(index):
+        def callback(q):
+            with lock:
+                if not winner:
+                    winner.append(index)
+                    for i, loser_cancel in enumerate(cancels):
+                        if i != index:
+                            loser_cancel.set()
+            if winner[0] != index:
+                raise _GenerationCancelled()
+            if on_question:
+                on_question(q)
+        return callback
+
+    # Don't block on the losers; they stop on their own once cancelled
+    futures = [
+        _submit_daemon(_generate_sharded, provider, session, difficulty,
+                       assist_prompt, make_callback(i), cancels[i])
+        for i, provider in enumerate(providers)
+    ]
+
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if winner:
+            return futures[winner[0]].result()
+    return None
+
+
+# --- UI Text ---
+# Shown in the explanation area after each answer
+TRANSLATION_HEADER = "日本語訳:\n"
+EXPLANATION_HEADER = "\n\n解説:\n"
+NO_TRANSLATION = "(日本語訳なし)"
+NO_EXPLANATION = "(解説なし)"
+
 
 # --- Main Application Class ---
 
@@ -312,14 +785,19 @@ class EnglishQuizApp:
         self.root = root
         self.root.title("English Quiz Tool")
         self.root.geometry("600x600")  # Increased height for new controls
+        # Set before anything can fail, so on_closing can always check them
+        self.conn = None
+        self.http = None
+        # Set by on_closing; in-flight API streams stop when they see it
+        self.shutdown = threading.Event()
 
-        # Load API Key
-        load_dotenv()
+        # Load API Key (.env was loaded at import time)
         self.api_provider = os.getenv("API_PROVIDER", "openrouter").lower()
         self.api_key = None
         self.model_name = None  # Store the actual model name being used
 
         if self.api_provider == "gemini":
+            provider_class = GeminiProvider
             self.api_key = os.getenv("GEMINI_API_KEY")
             # Use a default gemini model if not specified via OPENROUTER_MODEL
             self.model_name = os.getenv(
@@ -330,6 +808,7 @@ class EnglishQuizApp:
                 self.root.destroy()
                 return
         elif self.api_provider == "openrouter":
+            provider_class = OpenRouterProvider
             self.api_key = os.getenv("OPENROUTER_API_KEY")
             self.model_name = os.getenv(
                 "OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")
@@ -344,9 +823,34 @@ class EnglishQuizApp:
             self.root.destroy()
             return
 
-        # Database connection (only used in main thread)
+        # Providers queried per generation: the configured one first, plus
+        # the other one when fan-out is enabled and its key is available
+        self.providers = [provider_class(self.api_key, self.model_name)]
+        if API_FANOUT:
+            if self.api_provider == "openrouter" and os.getenv("GEMINI_API_KEY"):
+                self.providers.append(GeminiProvider(
+                    os.getenv("GEMINI_API_KEY"),
+                    os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")))
+            elif self.api_provider == "gemini" and os.getenv("OPENROUTER_API_KEY"):
+                # OPENROUTER_MODEL holds the Gemini model in this mode
+                self.providers.append(OpenRouterProvider(
+                    os.getenv("OPENROUTER_API_KEY"),
+                    os.getenv("OPENROUTER_FANOUT_MODEL",
+                              "mistralai/mistral-7b-instruct")))
+
+        # One HTTP session so API calls reuse pooled keep-alive connections
+        self.http = _create_http_session()
+
+        # Database connection, kept open for the app's lifetime. Worker
+        # threads use it too, so every access holds db_lock.
+        self.db_lock = threading.Lock()
         try:
-            self.conn = sqlite3.connect(DB_NAME)
+            # Autocommit mode; multi-statement writes use explicit BEGIN
+            self.conn = sqlite3.connect(DB_NAME, cached_statements=256,
+                                        isolation_level=None,
+                                        check_same_thread=False)
+            _configure_connection(self.conn)
+            self.conn.row_factory = sqlite3.Row
             self.cursor = self.conn.cursor()
         except sqlite3.Error as e:
             messagebox.showerror(
@@ -356,14 +860,38 @@ class EnglishQuizApp:
 
         # State variables
         self.questions = []
+        self._n_questions = 0  # len(self.questions), kept in step with it
         self.current_question_index = -1  # Becomes 0 for first question
         self.score = 0
         self.generating = False  # Flag to prevent concurrent generation
-        # Variable to hold the selected radio button value
+        # Next batch fetched in the background while the user answers;
+        # holds (cache_key, questions_data) once it has arrived.
+        self.prefetching = False
+        self.prefetch_key = None  # cache_key of the running prefetch
+        self.prefetched = None
+        # (difficulty, assist_prompt) of a generation that waits for the
+        # running prefetch instead of starting its own
+        self.awaiting_prefetch = None
+        # Cache keys generated for in this session (see start_generation_thread)
+        self.played_cache_keys = set()
+        # Worker threads never call into Tk; they post (handler, args) here
+        # and _poll_generation runs the handler on the main thread.
+        self._gen_queue = queue.Queue()
+        self._polling = False
+        # Variable to hold the selected radio button value. It only drives
+        # the radio indicators; _selected mirrors it in Python so that the
+        # answer can be read, and a reset skipped, without a Tcl call.
         self.selected_option = tk.IntVar()
+        self._selected = 0
         self.difficulty_var = tk.StringVar(
             value="Intermediate (B1)")  # Default difficulty
         self.prompt_assist_var = tk.StringVar()  # For auxiliary prompt input
+        # Label texts; setting a variable is cheaper than reconfiguring
+        self.info_var = tk.StringVar()
+        self.question_var = tk.StringVar(
+            value="Press 'Generate New Questions'")
+        self.feedback_var = tk.StringVar()
+        self._batch_depth = 0  # Nesting level of _batched_updates blocks
 
         # Setup UI
         self.setup_ui()
@@ -375,9 +903,11 @@ class EnglishQuizApp:
         # self.root.bind("<FocusIn>", lambda e: self.root.attributes('-topmost', True))
 
         # Load initial state
-        self.info_label.config(
-            text=f"Click 'Generate New Questions' to start.\n"
-            f"Provider: {self.api_provider.capitalize()} | Using model: {self.model_name}"
+        fanout = " | Fan-out enabled" if len(self.providers) > 1 else ""
+        self.info_var.set(
+            f"Click 'Generate New Questions' to start.\n"
+            f"Provider: {self.api_provider.capitalize()} | "
+            f"Using model: {self.model_name}{fanout}"
         )
 
     def setup_ui(self):
@@ -406,7 +936,8 @@ class EnglishQuizApp:
         self.generate_button.pack(side=tk.LEFT, padx=(0, 10))
 
         self.info_label = tk.Label(
-            gen_button_frame, text="", font=default_font, justify=tk.LEFT
+            gen_button_frame, textvariable=self.info_var, font=default_font,
+            justify=tk.LEFT
         )
         self.info_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
@@ -440,9 +971,22 @@ class EnglishQuizApp:
         top_frame = tk.Frame(main_frame)
         top_frame.pack(fill=tk.X, pady=(0, 10))
 
+        # Everything below belongs to one question; hidden by finish_quiz
+        self.quiz_frame = tk.Frame(main_frame)
+        self.quiz_frame.pack(fill=tk.BOTH, expand=True)
+
+        # --- Results (shown instead of quiz_frame when a quiz ends) ---
+        self.results_frame = tk.Frame(main_frame)
+        self.results_label = tk.Label(
+            self.results_frame, text="", font=question_font,
+            wraplength=550, justify=tk.LEFT
+        )
+        self.results_label.pack(pady=(10, 5), anchor='w')
+        self.showing_results = False
+
         # --- Middle Section: Question and Options ---
         self.question_label = tk.Label(
-            main_frame, text="Press 'Generate New Questions'",
+            self.quiz_frame, textvariable=self.question_var,
             font=question_font, wraplength=550, justify=tk.LEFT
         )
         # Reduced bottom padding
@@ -450,25 +994,36 @@ class EnglishQuizApp:
 
         self.option_buttons = []
         self.radio_buttons = []  # Store radio buttons
+        # Option texts are bound through StringVars, so setting them does not
+        # reconfigure the widgets
+        self.option_vars = []
         for i in range(4):
+            option_var = tk.StringVar(value=f"Option {i+1}")
             rb = tk.Radiobutton(
-                main_frame, text=f"Option {i+1}", variable=self.selected_option,
+                self.quiz_frame, textvariable=option_var,
+                variable=self.selected_option,
                 value=i + 1, font=button_font, state=tk.DISABLED,
                 anchor='w', justify=tk.LEFT,  # Align text left
-                command=self.check_answer  # Call check_answer directly on selection
+                # Call check_answer directly on selection
+                command=lambda value=i + 1: self.check_answer(value)
             )
             rb.pack(pady=2, fill=tk.X)  # Reduced padding
             self.radio_buttons.append(rb)
+            self.option_vars.append(option_var)
+        # Tk path names, for changing the state of all buttons in one call
+        self.radio_paths = tuple(str(rb) for rb in self.radio_buttons)
+        self.options_state = tk.DISABLED
 
         # --- Bottom Section: Feedback, Explanation, Navigation ---
         self.feedback_label = tk.Label(
-            main_frame, text="", font=feedback_font, pady=10
+            self.quiz_frame, textvariable=self.feedback_var,
+            font=feedback_font, pady=10
         )
         self.feedback_label.pack()
 
         # Use a Frame to contain ScrolledText and prevent resizing issues
         explanation_frame = tk.Frame(
-            main_frame, height=100)  # Set desired height
+            self.quiz_frame, height=100)  # Set desired height
         explanation_frame.pack(fill=tk.X, pady=(0, 10))
         # Prevent child widgets from resizing the frame
         explanation_frame.pack_propagate(False)
@@ -481,7 +1036,7 @@ class EnglishQuizApp:
         self.explanation_area.pack(fill=tk.BOTH, expand=True)
 
         self.next_button = tk.Button(
-            main_frame, text="Next Question", font=button_font,
+            self.quiz_frame, text="Next Question", font=button_font,
             command=self.next_question, state=tk.DISABLED
         )
         self.next_button.pack(pady=(5, 0))
@@ -492,35 +1047,78 @@ class EnglishQuizApp:
             return  # Don't start multiple generation threads
         self.generating = True
         self.generate_button.config(state=tk.DISABLED, text="Generating...")
-        self.info_label.config(text="Contacting OpenRouter API...")
+        self.info_var.set("Contacting OpenRouter API...")
         self.clear_quiz_area()  # Clear previous state
+        self.show_quiz_frame()
+
+        # Questions are appended as they stream in; index 0 == len(questions)
+        # means the first question is being waited for.
+        self.questions = []
+        self._n_questions = 0
+        self.current_question_index = 0
+        self.score = 0
+        self.question_queue = queue.Queue()
+
+        # Read Tk variables here; they must not be touched from the worker
+        difficulty = self.difficulty_var.get()
+        assist_prompt = self.prompt_assist_var.get().strip()
+        cache_key = _response_cache_key(
+            self.api_provider, self.model_name, difficulty, assist_prompt)
+        # The cache entry for a key is the last set played with it, so it
+        # is only new to the user the first time the key is used in a
+        # session; after that it would replay the current or previous quiz
+        played_before = cache_key in self.played_cache_keys
+        self.played_cache_keys.add(cache_key)
+
+        # A prefetched batch holds fresh questions, so prefer it to the cache
+        if self.prefetched and self.prefetched[0] == cache_key:
+            print("Using prefetched questions.")
+            prefetched_data = self.prefetched[1]
+            self.prefetched = None
+            self.handle_generation_result(prefetched_data, None, cache_key)
+            return
+
+        # The next batch is still on its way. Wait for it instead of sending
+        # a second generation or replaying the cache, which holds the set
+        # that was just played.
+        if self.prefetching and self.prefetch_key == cache_key:
+            print("Waiting for prefetched questions.")
+            self.info_var.set("Waiting for prefetched questions...")
+            self.awaiting_prefetch = (difficulty, assist_prompt)
+            return
+
+        if not played_before:
+            cached_data = self.load_cached_response(cache_key)
+            if cached_data:
+                print("Using cached API response.")
+                self.handle_generation_result(cached_data, None)
+                return
 
-        # Create and start the thread
+        self.start_generation_worker(difficulty, assist_prompt, cache_key)
+
+    def start_generation_worker(self, difficulty, assist_prompt, cache_key):
+        """Starts fetch_questions_worker and the polling of its output."""
         thread = threading.Thread(
-            target=self.fetch_questions_worker, daemon=True)
+            target=self.fetch_questions_worker,
+            args=(difficulty, assist_prompt, cache_key,
+                  self.question_queue.put),
+            daemon=True)
         thread.start()
+        self._schedule_poll()
+
+    def fetch_questions_worker(self, difficulty, assist_prompt, cache_key,
+                               on_question):
+        """Worker function: Calls API. Result passed back to main thread.
 
-    def fetch_questions_worker(self):
-        """Worker function: Calls API. Result passed back to main thread."""
+        Questions are also handed to on_question one by one as they stream in.
+        """
         api_data = None
         error_message = None
+        bank_questions = None
         try:
             print("Fetching questions from API...")
-            difficulty = self.difficulty_var.get()
-            assist_prompt = self.prompt_assist_var.get().strip()
-
-            # Dispatch to the correct API function based on provider
-            if self.api_provider == "gemini":
-                api_data = _generate_via_gemini(
-                    self.api_key, self.model_name, difficulty, assist_prompt)
-            elif self.api_provider == "openrouter":
-                api_data = _generate_via_openrouter(
-                    self.api_key, self.model_name, difficulty, assist_prompt)
-            else:
-                # This case should be caught in __init__, but as a safeguard:
-                error_message = f"Invalid API provider configured: {self.api_provider}"
-                api_data = None
-
+            api_data = self.generate_questions(
+                difficulty, assist_prompt, on_question)
             if not api_data:
                 error_message = ("API did not return question data. "
                                  "Check console.")
@@ -528,24 +1126,160 @@ class EnglishQuizApp:
             print(f"Error in API fetch worker: {e}")
             error_message = f"An error occurred during API call: {e}"
 
+        if error_message:
+            # Nothing was streamed; fall back to the local question bank
+            try:
+                with self.db_lock:
+                    if self.conn is not None:  # None once the app has closed
+                        bank_questions = _fetch_random_questions(
+                            self.conn, QUESTIONS_PER_GENERATION)
+            except sqlite3.Error as e:
+                print(f"Failed to load questions from database: {e}")
+
         # Pass result (or error) back to main thread for DB/UI updates
-        self.root.after(0, self.handle_generation_result,
-                        api_data, error_message)
+        self._gen_queue.put((self.handle_generation_result,
+                             (api_data, error_message, cache_key,
+                              bank_questions)))
+
+    def generate_questions(self, difficulty, assist_prompt, on_question=None):
+        """Calls the configured provider(s). Runs in a worker thread."""
+        return _generate_raced(self.providers, self.http, difficulty,
+                               assist_prompt, on_question, self.shutdown)
+
+    def start_prefetch(self):
+        """Fetches the next batch in the background for the current settings."""
+        if self.generating or self.prefetching:
+            return
+        difficulty = self.difficulty_var.get()
+        assist_prompt = self.prompt_assist_var.get().strip()
+        cache_key = _response_cache_key(
+            self.api_provider, self.model_name, difficulty, assist_prompt)
+        if self.prefetched and self.prefetched[0] == cache_key:
+            return  # Already have the next batch for these settings
+        self.prefetching = True
+        self.prefetch_key = cache_key
+        thread = threading.Thread(
+            target=self.prefetch_worker,
+            args=(difficulty, assist_prompt, cache_key), daemon=True)
+        thread.start()
+        self._schedule_poll()
+
+    def prefetch_worker(self, difficulty, assist_prompt, cache_key):
+        """Worker function for start_prefetch."""
+        api_data = None
+        try:
+            print("Prefetching next questions from API...")
+            api_data = self.generate_questions(difficulty, assist_prompt)
+        except Exception as e:
+            print(f"Error in API prefetch worker: {e}")
+        self._gen_queue.put((self.handle_prefetch_result,
+                             (api_data, cache_key)))
+
+    def handle_prefetch_result(self, prefetched_data, cache_key):
+        """Stores a finished prefetch for the next generation (main thread).
+
+        If a generation is waiting for this batch, plays it right away.
+        """
+        self.prefetching = False
+        awaiting = self.awaiting_prefetch
+        self.awaiting_prefetch = None
+        if awaiting:
+            if prefetched_data:
+                print("Using prefetched questions.")
+                self.handle_generation_result(prefetched_data, None, cache_key)
+            else:
+                # The prefetch failed; generate the usual way instead
+                self.start_generation_worker(*awaiting, cache_key)
+            return
+        if prefetched_data:
+            print(f"Prefetched {len(prefetched_data)} questions.")
+            self.prefetched = (cache_key, prefetched_data)
+
+    def _schedule_poll(self):
+        """Starts the _poll_generation loop unless it is already running."""
+        if not self._polling:
+            self._polling = True
+            self.root.after(50, self._poll_generation)
+
+    def _poll_generation(self):
+        """Delivers worker output to the UI every 50 ms while work is pending.
+
+        Moves streamed questions to the quiz, then runs any finished worker
+        result handlers posted to _gen_queue.
+        """
+        try:
+            if self.generating:
+                self.drain_question_queue()
+            while True:
+                try:
+                    handler, args = self._gen_queue.get_nowait()
+                except queue.Empty:
+                    break
+                handler(*args)
+        finally:
+            # Keep polling even if a handler raised
+            if self.generating or self.prefetching:
+                self.root.after(50, self._poll_generation)
+            else:
+                self._polling = False
+
+    def drain_question_queue(self):
+        """Appends streamed questions to self.questions (main thread).
 
-    def handle_generation_result(self, generated_data, error_message):
-        """Handles the result from the generation thread in the main thread."""
+        Shows the next question right away if the user is waiting for it.
+        """
+        waiting = self.current_question_index == self._n_questions
+        received = 0
+        while True:
+            try:
+                self.questions.append(self.question_queue.get_nowait())
+            except queue.Empty:
+                break
+            received += 1
+        if received:
+            self._n_questions += received
+            self.info_var.set(f"Received {self._n_questions} questions...")
+            if waiting:
+                self.display_question()
+
+    def handle_generation_result(self, generated_data, error_message,
+                                 cache_key=None, bank_questions=None):
+        """Handles the result from the generation thread in the main thread.
+
+        Streamed questions are already being played; generated_data is the
+        complete set to save. If cache_key is given and fan-out is off, a
+        successful result is also stored in the response cache.
+        bank_questions are played instead if generation failed.
+        """
         try:
+            self.drain_question_queue()
             if error_message:
-                messagebox.showerror("Generation Failed", error_message)
-                self.info_label.config(
-                    text="Generation failed. Please try again.")
+                if not self.questions and bank_questions:
+                    self.start_quiz(bank_questions)
+                    self.info_var.set(
+                        f"{len(bank_questions)} questions loaded from "
+                        "the question bank. Ready.")
+                    messagebox.showwarning(
+                        "Generation Failed", f"{error_message}\n\n"
+                        "Playing questions from the local question bank "
+                        "instead.")
+                else:
+                    messagebox.showerror("Generation Failed", error_message)
+                    self.info_var.set("Generation failed. Please try again.")
             elif generated_data:
                 print(f"Successfully fetched {len(generated_data)} questions.")
+                # The key names the primary provider and model, but with
+                # fan-out the other provider may have produced the set
+                if cache_key and len(self.providers) == 1:
+                    self.store_cached_response(cache_key, generated_data)
                 if self.save_questions_to_db(generated_data):
-                    self.load_questions_from_db()  # Load and display if save was successful
+                    if not self.questions:
+                        # Not streamed (e.g. cache hit): display directly
+                        self.start_quiz(list(generated_data))
+                    self.info_var.set(
+                        f"{self._n_questions} questions loaded. Ready.")
                 else:
-                    self.info_label.config(
-                        text="Failed to save questions. Check logs.")
+                    self.info_var.set("Failed to save questions. Check logs.")
                     messagebox.showerror(
                         "Error", "Failed to save generated questions to the "
                         "database.")
@@ -554,55 +1288,80 @@ class EnglishQuizApp:
                 messagebox.showerror(
                     "Generation Failed", "Could not generate questions. "
                     "Unknown API issue.")
-                self.info_label.config(
-                    text="Generation failed. Please try again.")
+                self.info_var.set("Generation failed. Please try again.")
 
         except Exception as e:
             # Catch errors during DB save or loading
             print(f"Error handling generation result: {e}")
             messagebox.showerror(
                 "Error", f"An error occurred processing results: {e}")
-            self.info_label.config(text="An error occurred.")
+            self.info_var.set("An error occurred.")
         finally:
             # Always ensure state is reset and button re-enabled
             self.generation_finished()
+            # check_answer could not prefetch while this generation ran;
+            # catch up if the user is already near the end
+            if (self.questions
+                    and self.current_question_index >= self._n_questions - 2):
+                self.start_prefetch()
+            # The user may have answered every streamed question already
+            if (self.questions
+                    and self.current_question_index >= self._n_questions):
+                self.finish_quiz()
 
     def save_questions_to_db(self, questions_data):
         """Saves generated questions to the DB. Called from main thread."""
-        saved_count = 0
+        rows = [
+            (q['question'], *q['options'], q['answer'], q['explanation'],
+             q['translation'])
+            for q in questions_data
+        ]
         try:
-            # Clear old questions before inserting new ones
-            self.cursor.execute("DELETE FROM problems")
-            self.conn.commit()
-
-            for q in questions_data:
-                try:
-                    self.cursor.execute("""
-                        INSERT INTO problems (question, option1, option2, option3, option4, answer, explanation, translation)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        q['question'], q['options'][0], q['options'][1],
-                        q['options'][2], q['options'][3], q['answer'],
-                        q['explanation'],
-                        q['translation']  # Add translation value
-                    ))
-                    saved_count += 1
-                except sqlite3.Error as insert_err:
-                    print(f"Error inserting question into DB: {insert_err}\n"
-                          f"Data: {q}")
-                    # Optionally decide whether to continue or stop on error
-            self.conn.commit()
-            print(
-                f"Saved {saved_count} out of {len(questions_data)} questions "
-                "to database.")
-            return saved_count > 0  # Indicate success if at least one question saved
+            # Add to the question bank in a single transaction; questions
+            # already in the bank are skipped. The connection is in
+            # autocommit mode, so the transaction is opened explicitly;
+            # 'with' commits it or rolls it back.
+            with self.db_lock, self.conn:
+                self.cursor.execute("BEGIN")
+                self.cursor.executemany(_SQL_INSERT, rows)
+            print(f"Saved {self.cursor.rowcount} new out of {len(rows)} "
+                  "questions to database.")
+            return True
         except sqlite3.Error as e:
+            # The transaction has been rolled back
             print(f"Database error during save: {e}")
             messagebox.showerror(
                 "Database Error", f"Failed to save questions to database: {e}")
-            # Attempt to rollback changes if commit failed? Might be complex.
             return False  # Indicate failure
 
+    def load_cached_response(self, cache_key):
+        """Returns cached question data younger than the TTL, or None."""
+        try:
+            with self.db_lock:
+                self.cursor.execute(
+                    _SQL_CACHE_GET,
+                    (cache_key, f"-{RESPONSE_CACHE_TTL_DAYS} days"))
+                row = self.cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Database error during cache lookup: {e}")
+            return None
+        if row is None:
+            return None
+        try:
+            return _unpack_cache_payload(row[0])
+        except (zlib.error, ValueError) as e:
+            print(f"Discarding unreadable cache entry: {e}")
+            return None
+
+    def store_cached_response(self, cache_key, questions_data):
+        """Stores question data in the response cache (main thread)."""
+        try:
+            payload = _pack_cache_payload(questions_data)
+            with self.db_lock:
+                self.cursor.execute(_SQL_CACHE_PUT, (cache_key, payload))
+        except sqlite3.Error as e:
+            print(f"Database error during cache store: {e}")
+
     def generation_finished(self):
         """Called from main thread after generation attempt finishes."""
         self.generating = False
@@ -610,153 +1369,186 @@ class EnglishQuizApp:
             state=tk.NORMAL, text="Generate New Questions")
         # Info label is updated by handle_generation_result
 
-    def load_questions_from_db(self):
-        """Loads questions from the database. Called from main thread."""
-        try:
-            self.cursor.execute(
-                "SELECT id, question, option1, option2, option3, "
-                "option4, answer, explanation, translation FROM problems ORDER BY id"
-            )
-            rows = self.cursor.fetchall()
-            self.questions = []
-            for row in rows:
-                self.questions.append({
-                    "id": row[0],
-                    "question": row[1],
-                    "options": [row[2], row[3], row[4], row[5]],
-                    "answer": row[6],
-                    "explanation": row[7],
-                    "translation": row[8]  # Store translation
-                })
-
-            if self.questions:
-                self.current_question_index = -1  # Reset index
-                self.score = 0
-                self.info_label.config(
-                    text=f"{len(self.questions)} questions loaded. Ready."
-                )
-                self.next_question()  # Display the first question
-            else:
-                self.info_label.config(
-                    text="No questions found in the database.")
-                self.clear_quiz_area()
-                # Don't show popup if just generated and saved 0 questions
-                # messagebox.showinfo("No Questions", "No questions were loaded.")
-
-        except sqlite3.Error as e:
-            messagebox.showerror(
-                "Database Error",
-                f"Failed to load questions from database: {e}"
-            )
-            self.clear_quiz_area()
+    def start_quiz(self, questions):
+        """Starts a new quiz round with the given questions."""
+        self.questions = questions
+        self._n_questions = len(questions)
+        self.current_question_index = -1  # Reset index
+        self.score = 0
+        self.next_question()  # Display the first question
 
     def display_question(self):
         """Updates the UI to show the current question."""
-        if 0 <= self.current_question_index < len(self.questions):
+        if 0 <= self.current_question_index < self._n_questions:
             q = self.questions[self.current_question_index]
-            self.question_label.config(
-                text=f"{self.current_question_index + 1}. {q['question']}"
-            )
-            for i, option_text in enumerate(q['options']):
-                self.radio_buttons[i].config(
-                    text=option_text, state=tk.NORMAL  # Enable and set text
+            with self._batched_updates():
+                self.question_var.set(
+                    f"{self.current_question_index + 1}. {q['question']}"
                 )
-            self.selected_option.set(0)  # Deselect all radio buttons
-
-            self.feedback_label.config(text="")
-            self.explanation_area.config(state=tk.NORMAL)
-            self.explanation_area.delete('1.0', tk.END)
-            self.explanation_area.config(state=tk.DISABLED)
-            self.next_button.config(state=tk.DISABLED)  # Disable 'Next'
+                for option_var, option_text in zip(self.option_vars,
+                                                   q['options']):
+                    option_var.set(option_text)
+                self.set_options_state(tk.NORMAL)
+                self.feedback_var.set("")
+                self.set_explanation("")
+                self.next_button.config(state=tk.DISABLED)  # Disable 'Next'
+                # Last, once all widgets are set up
+                self.reset_selection()  # Deselect all radio buttons
         else:
             # This case should ideally be handled by finish_quiz
             print("Warning: display_question called with invalid index.")
             self.clear_quiz_area()
 
-    def check_answer(self):
-        """Checks the selected radio button answer, provides feedback."""
-        if not (0 <= self.current_question_index < len(self.questions)):
-            return  # Should not happen if called via radio button
+    @contextmanager
+    def _batched_updates(self):
+        """Groups widget reconfigurations into one idle-task flush.
 
-        selected_option_number = self.selected_option.get()
-        if selected_option_number == 0:
-            return  # No selection made yet (or called prematurely)
+        Nested uses flush only once, when the outermost block exits.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.root.update_idletasks()
+
+    def set_options_state(self, state):
+        """Enables or disables all option radio buttons at once.
+
+        Runs a single Tcl foreach over the buttons instead of one configure
+        call per button, and nothing at all if the state is unchanged.
+        """
+        if state != self.options_state:
+            self.root.tk.call('foreach', 'w', self.radio_paths,
+                              f'$w configure -state {state}')
+            self.options_state = state
+
+    def reset_selection(self):
+        """Deselects all radio buttons, unless none is selected already."""
+        if self._selected:
+            self.selected_option.set(0)
+            self._selected = 0
+
+    def check_answer(self, selected_option_number):
+        """Checks the selected option (1-4), provides feedback."""
+        # The radio button is selected either way; keep the mirror in step
+        self._selected = selected_option_number
+        if not (0 <= self.current_question_index < self._n_questions):
+            return  # Should not happen if called via radio button
 
         q = self.questions[self.current_question_index]
         correct_answer = q['answer']
 
         # Disable option buttons after selection
-        for rb in self.radio_buttons:
-            rb.config(state=tk.DISABLED)
+        self.set_options_state(tk.DISABLED)
 
         is_correct = (selected_option_number == correct_answer)
 
         if is_correct:
             self.score += 1
-            self.feedback_label.config(text="正解！ (Correct!)", fg="green")
+            self.feedback_var.set("正解！ (Correct!)")
+            self.feedback_label.config(fg="green")
             # Highlighting radio buttons directly is less common, feedback label is primary
         else:
-            self.feedback_label.config(
-                text=f"残念！ (Incorrect!) 正解は {correct_answer}", fg="red"
-            )
+            self.feedback_var.set(f"残念！ (Incorrect!) 正解は {correct_answer}")
+            self.feedback_label.config(fg="red")
             # Optionally, you could change the text color of the correct radio button
             # if 1 <= correct_answer <= 4:
             #     self.radio_buttons[correct_answer - 1].config(fg='darkgreen')
 
         # Display explanation
-        self.explanation_area.config(state=tk.NORMAL)
-        self.explanation_area.delete('1.0', tk.END)
         # Get translation or default
-        translation_text = q.get('translation', '(日本語訳なし)')
-        explanation_text = q.get('explanation', '(解説なし)')
-        full_explanation = f"日本語訳:\n{translation_text}\n\n解説:\n{explanation_text}"
-        self.explanation_area.insert(
-            tk.END, full_explanation
-        )
-        self.explanation_area.config(state=tk.DISABLED)
+        translation_text = q.get('translation', NO_TRANSLATION)
+        explanation_text = q.get('explanation', NO_EXPLANATION)
+        self.set_explanation(f"{TRANSLATION_HEADER}{translation_text}"
+                             f"{EXPLANATION_HEADER}{explanation_text}")
 
         # Enable the Next button
         self.next_button.config(state=tk.NORMAL)
 
+        # Near the end of the quiz: start fetching the next batch now
+        if self.current_question_index >= self._n_questions - 2:
+            self.start_prefetch()
+
+    def set_explanation(self, text):
+        """Replaces the contents of the read-only explanation area."""
+        self.explanation_area.config(state=tk.NORMAL)
+        # One replace instead of delete + insert
+        self.explanation_area.replace('1.0', tk.END, text)
+        self.explanation_area.config(state=tk.DISABLED)
+
     def next_question(self):
         """Moves to the next question or finishes the quiz."""
         self.current_question_index += 1
-        if self.current_question_index < len(self.questions):
+        if self.current_question_index < self._n_questions:
             self.display_question()
+        elif self.generating:
+            # More questions are still streaming in; drain_question_queue
+            # displays the next one when it arrives.
+            self.clear_quiz_area(clear_info=False)
+            self.question_var.set("Waiting for the next question...")
         else:
             self.finish_quiz()
 
     def finish_quiz(self):
-        """Displays the final score and resets the quiz area."""
-        message = (f"Quiz Finished!\n\n"
-                   f"Your score: {self.score} / {len(self.questions)}")
-        self.clear_quiz_area(clear_info=False)  # Keep info label
-        self.question_label.config(text=message)
-        self.info_label.config(text="Generate new questions to play again.")
-        self.next_button.config(state=tk.DISABLED)
+        """Displays the final score in place of the quiz area.
+
+        The quiz widgets are only hidden; start_generation_thread resets them
+        before showing them again.
+        """
+        message = f"Quiz Finished!\n\nYour score: {self.score} / {self._n_questions}"
+        with self._batched_updates():
+            self.results_label.config(text=message)
+            if not self.showing_results:
+                self.quiz_frame.pack_forget()
+                self.results_frame.pack(fill=tk.BOTH, expand=True)
+                self.showing_results = True
+            self.info_var.set("Generate new questions to play again.")
+
+    def show_quiz_frame(self):
+        """Brings the quiz area back after finish_quiz replaced it."""
+        if self.showing_results:
+            self.results_frame.pack_forget()
+            self.quiz_frame.pack(fill=tk.BOTH, expand=True)
+            self.showing_results = False
 
     def clear_quiz_area(self, clear_info=True):
         """Resets the question, options, feedback, and explanation areas."""
-        self.question_label.config(text="")
-        for rb in self.radio_buttons:
-            rb.config(text="", state=tk.DISABLED)
-        self.selected_option.set(0)  # Reset selection
-        self.feedback_label.config(text="")
-        self.explanation_area.config(state=tk.NORMAL)
-        self.explanation_area.delete('1.0', tk.END)
-        self.explanation_area.config(state=tk.DISABLED)
-        self.next_button.config(state=tk.DISABLED)
-        if clear_info:
-            self.info_label.config(text="")
+        with self._batched_updates():
+            self.question_var.set("")
+            for option_var in self.option_vars:
+                option_var.set("")
+            self.set_options_state(tk.DISABLED)
+            self.feedback_var.set("")
+            self.set_explanation("")
+            self.next_button.config(state=tk.DISABLED)
+            if clear_info:
+                self.info_var.set("")
+            # Last, once all widgets are reset
+            self.reset_selection()
 
     def on_closing(self):
         """Handles cleanup when the window is closed."""
-        if hasattr(self, 'conn') and self.conn:
-            try:
-                self.conn.close()
-                print("Database connection closed.")
-            except sqlite3.Error as e:
-                print(f"Error closing database connection: {e}")
+        # Stop running generations; their threads are daemons and do not
+        # delay exit, but should not keep streaming in the meantime
+        self.shutdown.set()
+        if self.http is not None:
+            self.http.close()
+        if self.conn is not None:
+            with self.db_lock:
+                try:
+                    # Refresh query-planner statistics where they are stale
+                    self.conn.execute("PRAGMA optimize")
+                except sqlite3.Error as e:
+                    print(f"Error optimizing database: {e}")
+                try:
+                    self.conn.close()
+                    print("Database connection closed.")
+                except sqlite3.Error as e:
+                    print(f"Error closing database connection: {e}")
+                finally:
+                    self.conn = None  # Closing again is a no-op
         self.root.destroy()
 
 